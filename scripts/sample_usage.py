@@ -3,6 +3,7 @@ import sys
 from qtpy.QtWidgets import QApplication, QLabel, QListWidget, QVBoxLayout, QWidget
 
 from pyoncatqt.login import ONCatLogin
+from pyoncatqt.prefetch import PrefetchQuery
 
 
 class MainWindow(QWidget):
@@ -13,14 +14,23 @@ class MainWindow(QWidget):
 
         layout = QVBoxLayout()
 
-        # Create and add the Oncat widget
-        self.oncat_widget = ONCatLogin(key=key, parent=self)
+        # Create and add the Oncat widget, the instrument lists are fetched in the background once connected
+        self.oncat_widget = ONCatLogin(
+            key=key,
+            parent=self,
+            prefetch=[
+                PrefetchQuery("SNS", "Instrument", facility="SNS"),
+                PrefetchQuery("HFIR", "Instrument", facility="HFIR"),
+            ],
+        )
         self.oncat_widget.connection_updated.connect(self.update_instrument_lists)
+        self.oncat_widget.prefetch_completed.connect(self.fill_instrument_list)
         layout.addWidget(self.oncat_widget)
 
         # Add text input boxes for wavelength and run number
         self.sns_list = QListWidget()
         self.hfir_list = QListWidget()
+        self.instrument_lists = {"SNS": self.sns_list, "HFIR": self.hfir_list}
 
         layout.addWidget(QLabel("SNS Instruments:"))
         layout.addWidget(self.sns_list)
@@ -33,18 +43,17 @@ class MainWindow(QWidget):
 
     def update_instrument_lists(self: QWidget, is_connected: bool) -> None:
         """Update the contents of the instrument lists based on the connection status."""
-        self.sns_list.clear()
-        self.hfir_list.clear()
-
-        if is_connected:
-            sns_instruments = self.oncat_widget.agent.Instrument.list(facility="SNS")
-            hfir_instruments = self.oncat_widget.agent.Instrument.list(facility="HFIR")
-
-            for instrument in sns_instruments:
-                self.sns_list.addItem(instrument.get("name"))
-
-            for instrument in hfir_instruments:
-                self.hfir_list.addItem(instrument.get("name"))
+        for facility, instrument_list in self.instrument_lists.items():
+            instrument_list.clear()
+            if is_connected:
+                self.fill_instrument_list(facility)
+
+    def fill_instrument_list(self: QWidget, facility: str) -> None:
+        """Fill an instrument list from the prefetched instruments, if available."""
+        instrument_list = self.instrument_lists[facility]
+        instrument_list.clear()
+        for instrument in self.oncat_widget.prefetched(facility, []):
+            instrument_list.addItem(instrument.get("name"))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
+import functools
+import getpass
 import json
 import os
 import sys
-from typing import Any, Dict
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List
 
 import oauthlib
 import pyoncat
@@ -21,7 +25,238 @@ from qtpy.QtWidgets import (
     QWidget,
 )
 
+from pyoncatqt import tracing
 from pyoncatqt.configuration import get_data
+from pyoncatqt.prefetch import PrefetchQuery, get_prefetcher, prefetch_cache
+
+# resources shared by all the widgets of the application
+_shared_error_dialog = None
+_shared_agents = {}
+_shared_login_dialogs = {}
+_token_file_lock = threading.Lock()
+
+LOGIN_SPAN = "pyoncatqt.login"
+# the ONCatLoginDialog keyword arguments, login dialogs are shared by the widgets using the same ones
+LOGIN_DIALOG_OPTIONS = ("username_label", "password_label", "login_title", "password_echo")
+
+
+def get_login_name() -> str:
+    """Return the name of the logged in user, also when there is no controlling terminal (e.g. headless runs)"""
+    try:
+        return os.getlogin()
+    except OSError:
+        return getpass.getuser()
+
+
+def get_error_dialog() -> QErrorMessage:
+    """
+    Get the error dialog shared by all the login dialogs.
+
+    Returns
+    -------
+    QErrorMessage
+        The shared error dialog, created on first use.
+    """
+    global _shared_error_dialog
+    if _shared_error_dialog is None:
+        _shared_error_dialog = QErrorMessage()
+    return _shared_error_dialog
+
+
+def create_agent(oncat_url: str, client_id: str, token_getter: Callable, token_setter: Callable) -> pyoncat.ONCat:
+    """
+    Create an OnCat agent using the resource owner credentials flow.
+
+    Params
+    ------
+    oncat_url : str
+        The ONCat URL.
+    client_id : str
+        The ONCat client ID.
+    token_getter : Callable
+        The callback returning the stored token.
+    token_setter : Callable
+        The callback storing a new token.
+
+    Returns
+    -------
+    pyoncat.ONCat
+        The agent.
+    """
+    return tracing.TracedONCat(
+        oncat_url,
+        client_id=client_id,
+        # Pass in token getter/setter callbacks here:
+        token_getter=token_getter,
+        token_setter=token_setter,
+        flow=pyoncat.RESOURCE_OWNER_CREDENTIALS_FLOW,
+    )
+
+
+def get_shared_agent(oncat_url: str, client_id: str, token_path: str) -> pyoncat.ONCat:
+    """
+    Get the OnCat agent shared by the widgets using the same client ID and token file.
+
+    Params
+    ------
+    oncat_url : str
+        The ONCat URL.
+    client_id : str
+        The ONCat client ID.
+    token_path : str
+        The file the token is stored in.
+
+    Returns
+    -------
+    pyoncat.ONCat
+        The shared agent, created on first use.
+    """
+    key = (oncat_url, client_id, token_path)
+    with tracing.span("pyoncatqt.agent.get", endpoint=oncat_url, **{"cache.hit": key in _shared_agents}):
+        if key not in _shared_agents:
+            token_store = TokenStore(token_path)
+            _shared_agents[key] = create_agent(oncat_url, client_id, token_store.read, token_store.write)
+    return _shared_agents[key]
+
+
+def get_shared_login_dialog(
+    agent: pyoncat.ONCat, parent: QWidget = None, **kwargs: Dict[str, Any]
+) -> "ONCatLoginDialog":
+    """
+    Get the login dialog shared by the widgets using the same agent and dialog options.
+
+    Params
+    ------
+    agent : pyoncat.ONCat
+        The agent used by the dialog.
+    parent : QWidget, optional
+        The parent of the dialog when it is created, e.g. the window of the first widget using it.
+        The dialog is created again once its parent is deleted.
+    **kwargs : Dict[str, Any], optional
+        The ONCatLoginDialog keyword arguments, only the LOGIN_DIALOG_OPTIONS are used.
+
+    Returns
+    -------
+    ONCatLoginDialog
+        The shared login dialog, created on first use.
+    """
+    options = {name: kwargs[name] for name in LOGIN_DIALOG_OPTIONS if name in kwargs}
+    key = (agent, tuple(options.get(name) for name in LOGIN_DIALOG_OPTIONS))
+    if key not in _shared_login_dialogs:
+        dialog = ONCatLoginDialog(agent=agent, parent=parent, **options)
+        dialog.destroyed.connect(functools.partial(_forget_login_dialog, key, dialog))
+        _shared_login_dialogs[key] = dialog
+    return _shared_login_dialogs[key]
+
+
+def _forget_login_dialog(key: tuple, dialog: "ONCatLoginDialog") -> None:
+    """Remove a deleted login dialog from the shared dialogs"""
+    if _shared_login_dialogs.get(key) is dialog:
+        del _shared_login_dialogs[key]
+
+
+def clear_shared_resources() -> None:
+    """Release the shared agents, dialogs and prefetched results, all the widgets get new ones on next use"""
+    global _shared_error_dialog
+    prefetcher = get_prefetcher(create=False)
+    if prefetcher is not None:
+        prefetcher.cancel_all()
+    prefetch_cache.clear()
+    for dialog in _shared_login_dialogs.values():
+        dialog.deleteLater()
+    _shared_login_dialogs.clear()
+    _shared_agents.clear()
+    if _shared_error_dialog is not None:
+        _shared_error_dialog.deleteLater()
+        _shared_error_dialog = None
+
+
+def read_token_file(token_path: str) -> dict:
+    """
+    Read token from file.
+
+    Params
+    ------
+    token_path : str
+        The token file.
+
+    Returns
+    -------
+    dict
+        The token dictionary.
+    """
+    with tracing.span("pyoncatqt.token.read", **{"token.path": token_path}) as current:
+        # If there is not a token stored, return None
+        found = os.path.exists(token_path)
+        current.set_attribute("token.found", found)
+        if not found:
+            return None
+
+        with open(token_path, encoding="UTF-8") as storage:
+            content = storage.read()
+        current.set_attribute("bytes", len(content))
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            return None
+
+
+def write_token_file(token_path: str, token: dict, refresh: bool = False) -> None:
+    """
+    Write token to file.
+
+    Params
+    ------
+    token_path : str
+        The token file.
+    token : dict
+        The token dictionary.
+    refresh : bool, optional
+        Whether the token comes from a refresh, only recorded in the tracing span. Defaults to False.
+    """
+    with tracing.span("pyoncatqt.token.write", **{"token.path": token_path, "refresh": refresh}) as current:
+        content = json.dumps(token)
+        current.set_attribute("bytes", len(content))
+        # concurrent requests of an agent may save the token from worker threads
+        with _token_file_lock:
+            # Check if directory exists
+            if not os.path.exists(os.path.dirname(token_path)):
+                os.makedirs(os.path.dirname(token_path))
+            # Write token to a temporary file, readable by user only, and replace the token file at once
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(token_path), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "w", encoding="UTF-8") as storage:
+                    storage.write(content)
+                os.chmod(temporary_path, 0o600)
+                os.replace(temporary_path, token_path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+
+
+class TokenStore:
+    """
+    Token getter/setter callbacks of a shared agent, independent of any widget.
+
+    Params
+    ------
+    path : str
+        The file the token is stored in.
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self: "TokenStore", path: str) -> None:
+        self.path = path
+
+    def read(self: "TokenStore") -> dict:
+        """Read the token from file"""
+        return read_token_file(self.path)
+
+    def write(self: "TokenStore", token: dict) -> None:
+        """Write the token to file"""
+        # the agent saves a token outside of a login when it refreshes it
+        write_token_file(self.path, token, refresh=not tracing.in_span(LOGIN_SPAN))
 
 
 class ONCatLoginDialog(QDialog):
@@ -71,7 +306,7 @@ class ONCatLoginDialog(QDialog):
         self.setWindowTitle(window_title_text)
 
         username_label = QLabel(username_label_text)
-        self.user_name = QLineEdit(os.getlogin(), self)
+        self.user_name = QLineEdit(get_login_name(), self)
 
         password_label = QLabel(password_label_text)
         self.user_pwd = QLineEdit(self)
@@ -113,7 +348,10 @@ class ONCatLoginDialog(QDialog):
 
         self.user_pwd.setFocus()
 
-        self.error = QErrorMessage(self)
+    @property
+    def error(self: QDialog) -> QErrorMessage:
+        """The error dialog, shared by all the login dialogs"""
+        return get_error_dialog()
 
     def show_message(self: QDialog, msg: str) -> None:
         """Will show a error dialog with the given message"""
@@ -125,20 +363,30 @@ class ONCatLoginDialog(QDialog):
 
     def accept(self: QDialog) -> None:
         """Accept"""
-        try:
-            self.agent.login(
-                self.user_name.text(),
-                self.user_pwd.text(),
-            )
-        except oauthlib.oauth2.rfc6749.errors.InvalidGrantError:
-            self.show_message("Invalid username or password. Please try again.")
-            self.user_pwd.setText("")
-            return
-        except pyoncat.LoginRequiredError:
-            self.show_message("A username and/or password was not provided when logging in.")
-            self.user_pwd.setText("")
-            return
-
+        with tracing.span(LOGIN_SPAN, endpoint="oauth/token") as current:
+            try:
+                self.agent.login(
+                    self.user_name.text(),
+                    self.user_pwd.text(),
+                )
+            except oauthlib.oauth2.rfc6749.errors.InvalidGrantError:
+                current.set_attribute("login.success", False)
+                self.show_message("Invalid username or password. Please try again.")
+                self.user_pwd.setText("")
+                return
+            except pyoncat.LoginRequiredError:
+                current.set_attribute("login.success", False)
+                self.show_message("A username and/or password was not provided when logging in.")
+                self.user_pwd.setText("")
+                return
+            current.set_attribute("login.success", True)
+
+        # the results prefetched for the previous session may belong to another user
+        prefetcher = get_prefetcher(create=False)
+        if prefetcher is not None:
+            prefetcher.invalidate(self.agent)
+        # the dialog may be shared, do not keep the password around
+        self.user_pwd.setText("")
         self.login_status.emit(True)
         # close dialog
         self.close()
@@ -157,6 +405,8 @@ class ONCatLogin(QGroupBox):
         The key used to retrieve ONCat client ID from configuration. Defaults to None.
     parent : QWidget, optional
         The parent widget.
+    prefetch : List[PrefetchQuery | dict], optional
+        Queries run in the background as soon as the widget is connected. Defaults to None.
     kwargs : Dict[str, Any], optional
         Additional keyword arguments.
 
@@ -164,6 +414,15 @@ class ONCatLogin(QGroupBox):
     ----------
     connection_updated : Signal
         Signal emitted when the connection status is updated.
+    prefetch_completed : Signal
+        Signal emitted with the query name when a prefetched result is available.
+    prefetch_failed : Signal
+        Signal emitted with the query name and the exception when a prefetch query fails.
+    agent : pyoncat.ONCat
+        The OnCat agent, shared by the widgets using the same client ID and token file
+        unless the widget overrides read_token or write_token.
+    login_dialog : ONCatLoginDialog
+        The login dialog, shared by the widgets using the same agent and dialog options.
 
     Methods
     -------
@@ -179,12 +438,24 @@ class ONCatLogin(QGroupBox):
         Read token from file.
     write_token(token: dict) -> None:
         Write token to file.
+    start_prefetch() -> None:
+        Run the prefetch queries in the background.
+    prefetched(name: str, default=None) -> object:
+        Get the result of a prefetch query.
     """
 
     connection_updated = Signal(bool)
+    prefetch_completed = Signal(str)
+    prefetch_failed = Signal(str, object)
 
     def __init__(
-        self: QGroupBox, *, client_id: str = None, key: str = None, parent: QWidget = None, **kwargs: Dict[str, Any]
+        self: QGroupBox,
+        *,
+        client_id: str = None,
+        key: str = None,
+        parent: QWidget = None,
+        prefetch: List[PrefetchQuery | dict] = None,
+        **kwargs: Dict[str, Any],
     ) -> None:
         """
         Initialize the ONCatLogin widget.
@@ -197,6 +468,8 @@ class ONCatLogin(QGroupBox):
             The key used to retrieve ONCat client ID from configuration. Defaults to None.
         parent : QWidget, optional
             The parent widget.
+        prefetch : List[PrefetchQuery | dict], optional
+            Queries run in the background as soon as the widget is connected. Defaults to None.
         **kwargs : Dict[str, Any], optional
             Additional keyword arguments.
         """
@@ -234,27 +507,86 @@ class ONCatLogin(QGroupBox):
             token_filename = f"{key}_token.json"
         self.token_path = os.path.abspath(f"{os.path.expanduser('~')}/.pyoncatqt/{token_filename}")
 
-        self.agent = pyoncat.ONCat(
-            self.oncat_url,
-            client_id=self.client_id,
-            # Pass in token getter/setter callbacks here:
-            token_getter=self.read_token,
-            token_setter=self.write_token,
-            flow=pyoncat.RESOURCE_OWNER_CREDENTIALS_FLOW,
-        )
+        # widgets using the same client and token file share the agent and the login dialog,
+        # a widget storing the token itself by overriding read_token or write_token has its own agent
+        self._agent_key = (self.oncat_url, self.client_id, self.token_path)
+        if self._stores_token():
+            self._agent = create_agent(self.oncat_url, self.client_id, self.read_token, self.write_token)
+        else:
+            self._agent = None
+            get_shared_agent(*self._agent_key)
+        self._login_dialog = None
+        self._login_dialog_kwargs = kwargs
+
+        # results are shared with the widgets using the same agent
+        self.prefetch_queries = [PrefetchQuery.from_value(query) for query in prefetch or []]
+        if self.prefetch_queries:
+            prefetcher = get_prefetcher()
+            prefetcher.completed.connect(self._prefetch_completed)
+            prefetcher.failed.connect(self._prefetch_failed)
+        # set by is_connected when the server requires a new login
+        self._login_required = False
 
-        self.login_dialog = ONCatLoginDialog(agent=self.agent, parent=self, **kwargs)
         self.update_connection_status()
 
+    @property
+    def agent(self: QGroupBox) -> pyoncat.ONCat:
+        """
+        The OnCat agent, looked up in the shared agents on each access unless set on the widget,
+        so that existing widgets use the new agent after clear_shared_resources.
+
+        Returns
+        -------
+        pyoncat.ONCat
+            The OnCat agent.
+        """
+        if self._agent is not None:
+            return self._agent
+        agent = _shared_agents.get(self._agent_key)
+        return agent if agent is not None else get_shared_agent(*self._agent_key)
+
+    @agent.setter
+    def agent(self: QGroupBox, agent: pyoncat.ONCat) -> None:
+        self._agent = agent
+
+    @property
+    def login_dialog(self: QGroupBox) -> ONCatLoginDialog:
+        """
+        The login dialog, shared with the widgets using the same agent and created on first use.
+        It is looked up on each access unless set on the widget, so it is never a deleted dialog.
+
+        Returns
+        -------
+        ONCatLoginDialog
+            The login dialog.
+        """
+        if self._login_dialog is not None:
+            return self._login_dialog
+        return get_shared_login_dialog(self.agent, parent=self.window(), **self._login_dialog_kwargs)
+
+    @login_dialog.setter
+    def login_dialog(self: QGroupBox, dialog: ONCatLoginDialog) -> None:
+        self._login_dialog = dialog
+
     def update_connection_status(self: QGroupBox) -> None:
         """Update connection status"""
-        if self.is_connected:
+        # probe the server once per update
+        agent = self.agent
+        is_connected = self.is_connected
+        if is_connected:
             self.status_label.setText("ONCat: Connected")
             self.status_label.setStyleSheet("color: green")
         else:
             self.status_label.setText("ONCat: Disconnected")
             self.status_label.setStyleSheet("color: red")
-        self.connection_updated.emit(self.is_connected)
+        # warm the cache as soon as authenticated, drop the results once the session ended,
+        # a network error keeps them
+        prefetcher = get_prefetcher(create=False)
+        if self._login_required and prefetcher is not None:
+            prefetcher.invalidate(agent)
+        elif is_connected and any((agent, query.name) not in prefetch_cache for query in self.prefetch_queries):
+            self.start_prefetch()
+        self.connection_updated.emit(is_connected)
 
     @property
     def is_connected(self: QGroupBox) -> bool:
@@ -267,15 +599,21 @@ class ONCatLogin(QGroupBox):
             True if connected, False otherwise.
         """
 
-        try:
-            self.agent.Facility.list()
-            return True
-        except pyoncat.InvalidRefreshTokenError:
-            return False
-        except pyoncat.LoginRequiredError:
-            return False
-        except Exception:  # noqa BLE001
-            return False
+        with tracing.span("pyoncatqt.is_connected", endpoint="api/facilities") as current:
+            self._login_required = False
+            try:
+                self.agent.Facility.list()
+                connected = True
+            except pyoncat.InvalidRefreshTokenError:
+                connected = False
+                self._login_required = True
+            except pyoncat.LoginRequiredError:
+                connected = False
+                self._login_required = True
+            except Exception:  # noqa BLE001
+                connected = False
+            current.set_attribute("connected", connected)
+        return connected
 
     def get_agent_instance(self: QGroupBox) -> pyoncat.ONCat:
         """
@@ -295,39 +633,78 @@ class ONCatLogin(QGroupBox):
         self.update_connection_status()
         # self.parent.update_boxes()
 
+    def _stores_token(self: QGroupBox) -> bool:
+        """
+        Check if the widget stores the token itself.
+
+        Returns
+        -------
+        bool
+            True if a subclass overrides read_token or write_token, False otherwise.
+        """
+        cls = type(self)
+        return cls.read_token is not ONCatLogin.read_token or cls.write_token is not ONCatLogin.write_token
+
     def read_token(self: QGroupBox) -> dict:
         """
         Read token from file.
 
+        This is the token getter of the agent of a widget overriding it, e.g. to read the token from a keyring.
+        Such a widget does not share its agent with the other widgets.
+
         Returns
         -------
         dict
             The token dictionary.
         """
-        # If there is not a token stored, return None
-        if not os.path.exists(self.token_path):
-            return None
-
-        with open(self.token_path, encoding="UTF-8") as storage:
-            try:
-                return json.load(storage)
-            except json.JSONDecodeError:
-                return None
+        return read_token_file(self.token_path)
 
     def write_token(self: QGroupBox, token: dict) -> None:
         """
         Write token to file.
 
+        This is the token setter of the agent of a widget overriding it, e.g. to write the token to a keyring.
+        Such a widget does not share its agent with the other widgets.
+
         Params
         ------
         token : dict
             The token dictionary.
         """
-        # Check if directory exists
-        if not os.path.exists(os.path.dirname(self.token_path)):
-            os.makedirs(os.path.dirname(self.token_path))
-        # Write token to file
-        with open(self.token_path, "w", encoding="UTF-8") as storage:
-            json.dump(token, storage)
-        # Change permissions to read-only by user
-        os.chmod(self.token_path, 0o600)
+        # the agent of a widget storing the token itself saves it outside of a login when it refreshes it
+        write_token_file(self.token_path, token, refresh=not tracing.in_span(LOGIN_SPAN))
+
+    def start_prefetch(self: QGroupBox) -> None:
+        """Run the prefetch queries concurrently in the background"""
+        if self.prefetch_queries:
+            get_prefetcher().prefetch(self.agent, self.prefetch_queries)
+
+    def prefetched(self: QGroupBox, name: str, default: object = None) -> object:
+        """
+        Get the result of a prefetch query.
+
+        Params
+        ------
+        name : str
+            The name of the query.
+        default : object, optional
+            The value returned if the result is not available yet. Defaults to None.
+
+        Returns
+        -------
+        object
+            The prefetched result or the default.
+        """
+        with tracing.span("pyoncatqt.prefetch.get", query=name) as current:
+            current.set_attribute("cache.hit", (self.agent, name) in prefetch_cache)
+            return prefetch_cache.get(self.agent, name, default)
+
+    def _prefetch_completed(self: QGroupBox, agent: pyoncat.ONCat, name: str) -> None:
+        """Forward the completion of the queries of this widget"""
+        if agent is self.agent and any(query.name == name for query in self.prefetch_queries):
+            self.prefetch_completed.emit(name)
+
+    def _prefetch_failed(self: QGroupBox, agent: pyoncat.ONCat, name: str, error: Exception) -> None:
+        """Forward the failures of the queries of this widget"""
+        if agent is self.agent and any(query.name == name for query in self.prefetch_queries):
+            self.prefetch_failed.emit(name, error)
@@ -0,0 +1,294 @@
+"""Module to declare the ONCat queries to prefetch once logged in, and the cache holding their results"""
+
+import functools
+import time
+import weakref
+from typing import Any, Dict, List
+
+import pyoncat
+from qtpy.QtCore import QObject, Signal
+
+from pyoncatqt import tracing
+from pyoncatqt.tasks import ONCatTaskRunner
+
+
+class PrefetchQuery:
+    """
+    A declarative ONCat query, run on an agent as ``agent.<resource>.<method>(**params)``.
+
+    Params
+    ------
+    name : str
+        The name the result is cached under.
+    resource : str
+        The pyoncat resource, e.g. "Instrument" or "Experiment".
+    method : str, optional
+        The resource method. Defaults to "list".
+    **params : Dict[str, Any], optional
+        The query parameters, e.g. ``facility="SNS"``.
+    """
+
+    __slots__ = ("name", "resource", "method", "params")
+
+    def __init__(
+        self: "PrefetchQuery", name: str, resource: str, method: str = "list", **params: Dict[str, Any]
+    ) -> None:
+        self.name = name
+        self.resource = resource
+        self.method = method
+        self.params = params
+
+    @classmethod
+    def from_value(cls: type, value: "PrefetchQuery | dict") -> "PrefetchQuery":
+        """
+        Create a query from a PrefetchQuery or a dictionary.
+
+        Params
+        ------
+        value : PrefetchQuery | dict
+            The query, or a dictionary with the "name", "resource", optional "method" and "params" keys.
+
+        Returns
+        -------
+        PrefetchQuery
+            The query.
+        """
+        if isinstance(value, cls):
+            return value
+        try:
+            return cls(value["name"], value["resource"], value.get("method", "list"), **value.get("params", {}))
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError(f"Invalid prefetch query {value}. A name and a resource are required.") from None
+
+    def run(self: "PrefetchQuery", agent: pyoncat.ONCat) -> object:
+        """
+        Run the query.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent to query.
+
+        Returns
+        -------
+        object
+            The result of the query.
+        """
+        return getattr(getattr(agent, self.resource), self.method)(**self.params)
+
+    def __repr__(self: "PrefetchQuery") -> str:
+        params = ", ".join(f"{key}={value!r}" for key, value in self.params.items())
+        return f"PrefetchQuery({self.name!r}, {self.resource}.{self.method}({params}))"
+
+
+class PrefetchCache:
+    """
+    Results of the prefetched queries, per agent and query name.
+
+    The results of an agent are released with the agent.
+
+    Methods
+    -------
+    get(agent, name, default=None) -> object:
+        Get a cached result.
+    set(agent, name, value) -> None:
+        Cache a result.
+    age(agent, name) -> float:
+        Get the age of a cached result in seconds.
+    discard(agent) -> None:
+        Remove the cached results of an agent.
+    clear() -> None:
+        Remove all the cached results.
+    """
+
+    def __init__(self: "PrefetchCache") -> None:
+        self._entries = weakref.WeakKeyDictionary()
+
+    def __contains__(self: "PrefetchCache", key: tuple) -> bool:
+        agent, name = key
+        return name in self._entries.get(agent, ())
+
+    def get(self: "PrefetchCache", agent: pyoncat.ONCat, name: str, default: object = None) -> object:
+        """
+        Get a cached result.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent the query was run on.
+        name : str
+            The name of the query.
+        default : object, optional
+            The value returned if the result is not cached. Defaults to None.
+
+        Returns
+        -------
+        object
+            The cached result or the default.
+        """
+        entry = self._entries.get(agent, {}).get(name)
+        return default if entry is None else entry[0]
+
+    def set(self: "PrefetchCache", agent: pyoncat.ONCat, name: str, value: object) -> None:
+        """
+        Cache a result, replacing the previous one.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent the query was run on.
+        name : str
+            The name of the query.
+        value : object
+            The result of the query.
+        """
+        self._entries.setdefault(agent, {})[name] = (value, time.monotonic())
+
+    def age(self: "PrefetchCache", agent: pyoncat.ONCat, name: str) -> float:
+        """
+        Get the age of a cached result.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent the query was run on.
+        name : str
+            The name of the query.
+
+        Returns
+        -------
+        float
+            The time in seconds since the result was cached, None if not cached.
+        """
+        entry = self._entries.get(agent, {}).get(name)
+        return None if entry is None else time.monotonic() - entry[1]
+
+    def discard(self: "PrefetchCache", agent: pyoncat.ONCat) -> None:
+        """
+        Remove the cached results of an agent, e.g. once it is disconnected.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent the queries were run on.
+        """
+        self._entries.pop(agent, None)
+
+    def clear(self: "PrefetchCache") -> None:
+        """Remove all the cached results"""
+        self._entries.clear()
+
+
+class Prefetcher(QObject):
+    """
+    Runs prefetch queries in the background and stores their results in a cache.
+
+    A query already running for an agent is not started again, so widgets sharing an agent
+    and declaring the same queries only fetch them once. The queries run concurrently: they are started
+    right after a successful connection probe, which refreshed the token if needed, so they do not race
+    to refresh it, and the token file writes are serialized by the login module.
+
+    Params
+    ------
+    cache : PrefetchCache, required
+        The cache the results are stored in.
+    parent : QObject, optional
+        The parent object.
+
+    Attributes
+    ----------
+    completed : Signal
+        Signal emitted with the agent and the query name once a result is cached.
+    failed : Signal
+        Signal emitted with the agent, the query name and the exception when a query fails.
+    """
+
+    completed = Signal(object, str)
+    failed = Signal(object, str, object)
+
+    def __init__(self: QObject, cache: PrefetchCache, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.cache = cache
+        self.runner = ONCatTaskRunner(self)
+        self._pending = {}
+
+    def prefetch(self: QObject, agent: pyoncat.ONCat, queries: List[PrefetchQuery]) -> None:
+        """
+        Start the queries in the background.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent to query.
+        queries : List[PrefetchQuery]
+            The queries to run.
+        """
+        for query in queries:
+            key = (agent, query.name)
+            if key in self._pending:
+                continue
+            task = self.runner.submit(self._run, agent, query, group=key)
+            task.signals.finished.connect(functools.partial(self._store, agent, query.name))
+            task.signals.failed.connect(functools.partial(self.failed.emit, agent, query.name))
+            task.signals.done.connect(functools.partial(self._forget, key, task))
+            self._pending[key] = task
+
+    def invalidate(self: QObject, agent: pyoncat.ONCat) -> None:
+        """
+        Drop the results of an agent and cancel its running queries, e.g. when it is disconnected
+        or another user logs in, so that the previous session's results are not used.
+
+        Params
+        ------
+        agent : pyoncat.ONCat
+            The agent.
+        """
+        for key in [key for key in self._pending if key[0] is agent]:
+            del self._pending[key]
+            self.runner.cancel(key)
+        self.cache.discard(agent)
+
+    def cancel_all(self: QObject) -> None:
+        """Cancel the queries still running, their results are not cached"""
+        self.runner.cancel_all()
+
+    @staticmethod
+    def _run(agent: pyoncat.ONCat, query: PrefetchQuery) -> object:
+        """Run a query in a worker thread"""
+        with tracing.span("pyoncatqt.prefetch", query=query.name, endpoint=f"{query.resource}.{query.method}"):
+            return query.run(agent)
+
+    def _forget(self: QObject, key: tuple, task: object) -> None:
+        """Drop a query once done, unless it was replaced by a new one"""
+        if self._pending.get(key) is task:
+            del self._pending[key]
+
+    def _store(self: QObject, agent: pyoncat.ONCat, name: str, value: object) -> None:
+        """Cache the result of a query, in the GUI thread"""
+        self.cache.set(agent, name, value)
+        self.completed.emit(agent, name)
+
+
+# cache shared by all the widgets of the application
+prefetch_cache = PrefetchCache()
+_prefetcher = None
+
+
+def get_prefetcher(create: bool = True) -> Prefetcher:
+    """
+    Get the prefetcher shared by all the widgets, storing the results in ``prefetch_cache``.
+
+    Params
+    ------
+    create : bool, optional
+        Create the prefetcher if it does not exist yet. Defaults to True.
+
+    Returns
+    -------
+    Prefetcher
+        The shared prefetcher, created on first use, None if not created yet and ``create`` is False.
+    """
+    global _prefetcher
+    if _prefetcher is None and create:
+        _prefetcher = Prefetcher(prefetch_cache)
+    return _prefetcher
@@ -0,0 +1,415 @@
+"""Module to run ONCat calls in the background without blocking the GUI thread"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from qtpy.QtCore import QCoreApplication, QObject, QRunnable, Qt, QThreadPool, Signal
+
+
+class TaskCancelledError(Exception):
+    """Raised inside a running task once it has been cancelled"""
+
+
+class ONCatTaskSignals(QObject):
+    """
+    Signals emitted by an ONCatTask.
+
+    The signals object lives in the thread that created the task (normally the GUI thread).
+    The task posts its signals to that thread, where they are emitted once control returns to the
+    event loop: connected slots are invoked there, and slots connected right after the task is
+    started do not miss a task that completes quickly.
+
+    Attributes
+    ----------
+    finished : Signal
+        Emitted with the result of the task when it completes.
+    failed : Signal
+        Emitted with the exception raised by the task.
+    progress : Signal
+        Emitted with the number of pages and records fetched so far by a paged task.
+    cancelled : Signal
+        Emitted when the task was cancelled or superseded; its result is discarded.
+    done : Signal
+        Emitted last, whatever the outcome of the task.
+    """
+
+    finished = Signal(object)
+    failed = Signal(object)
+    progress = Signal(int, int)
+    cancelled = Signal()
+    done = Signal()
+    _relay = Signal(str, tuple)
+
+    def __init__(self: QObject, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._relay.connect(self._emit, Qt.QueuedConnection)
+
+    def post(self: QObject, name: str, *args: List[Any]) -> None:
+        """
+        Emit a signal in the thread of the signals object, from any thread.
+
+        Params
+        ------
+        name : str
+            The name of the signal, e.g. "finished".
+        *args : List[Any], optional
+            The arguments of the signal.
+        """
+        self._relay.emit(name, args)
+
+    def _emit(self: QObject, name: str, args: tuple) -> None:
+        """Emit a posted signal"""
+        getattr(self, name).emit(*args)
+
+
+class ONCatTask(QRunnable):
+    """
+    A cancellable unit of work, typically a call on a pyoncat.ONCat agent.
+
+    Params
+    ------
+    fn : Callable, required
+        The callable to run in a worker thread.
+    *args, **kwargs : optional
+        Arguments passed to ``fn``.
+
+    Methods
+    -------
+    cancel() -> None:
+        Request cancellation of the task.
+    check_cancelled() -> None:
+        Raise TaskCancelledError if the task has been cancelled.
+    """
+
+    def __init__(self: QRunnable, fn: Callable, *args: List[Any], **kwargs: Dict[str, Any]) -> None:
+        super().__init__()
+        # the runner keeps a reference until the task is done
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = ONCatTaskSignals()
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self: QRunnable) -> bool:
+        """
+        Check if the task has been cancelled.
+
+        Returns
+        -------
+        bool
+            True if cancelled, False otherwise.
+        """
+        return self._cancel_event.is_set()
+
+    def cancel(self: QRunnable) -> None:
+        """Request cancellation, a running call is not interrupted but its result is discarded"""
+        self._cancel_event.set()
+
+    def check_cancelled(self: QRunnable) -> None:
+        """Raise TaskCancelledError if the task has been cancelled"""
+        if self.is_cancelled:
+            raise TaskCancelledError()
+
+    def execute(self: QRunnable) -> object:
+        """
+        Execute the work of the task in the worker thread.
+
+        Returns
+        -------
+        object
+            The result emitted by the finished signal.
+        """
+        return self.fn(*self.args, **self.kwargs)
+
+    def run(self: QRunnable) -> None:
+        """Run the task, called by the thread pool"""
+        try:
+            self.check_cancelled()
+            result = self.execute()
+            self.check_cancelled()
+        except TaskCancelledError:
+            self.signals.post("cancelled")
+        except Exception as error:  # noqa BLE001
+            if self.is_cancelled:
+                self.signals.post("cancelled")
+            else:
+                self.signals.post("failed", error)
+        else:
+            self.signals.post("finished", result)
+        finally:
+            self.signals.post("done")
+
+
+class ONCatPagedTask(ONCatTask):
+    """
+    A task fetching a long query page by page, reporting progress and checking for
+    cancellation between pages.
+
+    Params
+    ------
+    fetch_page : Callable[[int, int], list], required
+        Called with the page index and the page size, returns the records of that page.
+    page_size : int, optional
+        The number of records requested per page. Defaults to 100.
+    """
+
+    def __init__(self: QRunnable, fetch_page: Callable[[int, int], list], page_size: int = 100) -> None:
+        super().__init__(fetch_page)
+        if page_size < 1:
+            raise ValueError(f"Invalid page size {page_size}. The page size must be positive.")
+        self.page_size = page_size
+
+    def execute(self: QRunnable) -> list:
+        """
+        Fetch pages until a short page is returned.
+
+        Returns
+        -------
+        list
+            The records of all the pages.
+        """
+        records = []
+        page = 0
+        while True:
+            self.check_cancelled()
+            batch = list(self.fn(page, self.page_size))
+            records.extend(batch)
+            page += 1
+            self.signals.post("progress", page, len(records))
+            if len(batch) < self.page_size:
+                return records
+
+
+class ONCatTaskRunner(QObject):
+    """
+    QThreadPool-backed runner for ONCat tasks.
+
+    Tasks submitted with the same ``group`` supersede each other: submitting a new task
+    cancels the previous one of that group, so only the latest request delivers its result.
+    A running task is not interrupted, its call goes on until the server answers.
+
+    Tasks submitted with the same ``serial`` key run one at a time, in submission order. Pass the agent
+    as key when its calls may overlap: the token refresh of a pyoncat.ONCat agent is not thread safe,
+    concurrent calls may each refresh an expired token. A waiting task does not hold a worker thread
+    and never runs once cancelled.
+
+    Params
+    ------
+    parent : QObject, optional
+        The parent object.
+    max_threads : int, optional
+        The maximum number of worker threads. Defaults to the Qt default (number of cores).
+
+    Methods
+    -------
+    submit(fn, *args, group=None, priority=0, serial=None, **kwargs) -> ONCatTask:
+        Run fn(*args, **kwargs) in the background.
+    submit_paged(fetch_page, page_size=100, group=None, priority=0, serial=None) -> ONCatPagedTask:
+        Run a paged query in the background.
+    start(task, group=None, priority=0, serial=None) -> ONCatTask:
+        Start an already created task.
+    cancel(group) -> None:
+        Cancel the current task of a group.
+    cancel_all() -> None:
+        Cancel all pending and running tasks.
+    wait_for_done(msecs=-1) -> bool:
+        Wait for all the tasks to be done.
+    """
+
+    def __init__(self: QObject, parent: QObject = None, max_threads: int = None) -> None:
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self._tasks = []
+        self._groups = {}
+        # tasks per serial key, the first one is started and the others wait for it
+        self._serial = {}
+
+    @property
+    def active_count(self: QObject) -> int:
+        """
+        Number of tasks that are pending or running.
+
+        Returns
+        -------
+        int
+            The number of tasks not done yet.
+        """
+        return len(self._tasks)
+
+    def submit(
+        self: QObject,
+        fn: Callable,
+        *args: List[Any],
+        group: str = None,
+        priority: int = 0,
+        serial: object = None,
+        **kwargs: Dict[str, Any],
+    ) -> ONCatTask:
+        """
+        Run a callable in a worker thread.
+
+        Params
+        ------
+        fn : Callable, required
+            The callable, e.g. ``agent.Instrument.list``.
+        *args, **kwargs : optional
+            Arguments passed to ``fn``.
+        group : str, optional
+            Cancel the previous task of this group and replace it with the new task.
+        priority : int, optional
+            Tasks with a higher priority are started first. Defaults to 0.
+        serial : object, optional
+            Run the tasks with this key, e.g. an agent, one at a time in submission order. Defaults to None.
+
+        Returns
+        -------
+        ONCatTask
+            The task, connect to its ``signals`` to receive the result.
+        """
+        return self.start(ONCatTask(fn, *args, **kwargs), group=group, priority=priority, serial=serial)
+
+    def submit_paged(
+        self: QObject,
+        fetch_page: Callable[[int, int], list],
+        page_size: int = 100,
+        group: str = None,
+        priority: int = 0,
+        serial: object = None,
+    ) -> ONCatPagedTask:
+        """
+        Run a paged query in a worker thread.
+
+        Params
+        ------
+        fetch_page : Callable[[int, int], list], required
+            Called with the page index and the page size, returns the records of that page.
+        page_size : int, optional
+            The number of records requested per page. Defaults to 100.
+        group : str, optional
+            Cancel the previous task of this group and replace it with the new task.
+        priority : int, optional
+            Tasks with a higher priority are started first. Defaults to 0.
+        serial : object, optional
+            Run the tasks with this key, e.g. an agent, one at a time in submission order. Defaults to None.
+
+        Returns
+        -------
+        ONCatPagedTask
+            The task, connect to its ``signals`` to receive progress and the records.
+        """
+        return self.start(ONCatPagedTask(fetch_page, page_size), group=group, priority=priority, serial=serial)
+
+    def start(self: QObject, task: ONCatTask, group: str = None, priority: int = 0, serial: object = None) -> ONCatTask:
+        """
+        Start a task in the thread pool.
+
+        Params
+        ------
+        task : ONCatTask, required
+            The task to start.
+        group : str, optional
+            Cancel the previous task of this group and replace it with the new task.
+        priority : int, optional
+            Tasks with a higher priority are started first. Defaults to 0.
+        serial : object, optional
+            Run the tasks with this key, e.g. an agent, one at a time in submission order. Defaults to None.
+
+        Returns
+        -------
+        ONCatTask
+            The started task.
+        """
+        if group is not None:
+            self.cancel(group)
+            self._groups[group] = task
+        self._tasks.append(task)
+        task.signals.done.connect(lambda: self._forget(task, group, serial))
+        if serial is not None:
+            queue = self._serial.setdefault(serial, [])
+            queue.append((task, priority))
+            if len(queue) > 1:
+                # started once the previous tasks of the key are done
+                return task
+        self.pool.start(task, priority)
+        return task
+
+    def cancel(self: QObject, group: str) -> None:
+        """
+        Cancel the current task of a group.
+
+        Params
+        ------
+        group : str
+            The group of the task.
+        """
+        task = self._groups.pop(group, None)
+        if task is not None:
+            self._cancel_task(task)
+
+    def cancel_all(self: QObject) -> None:
+        """Cancel all pending and running tasks"""
+        self._groups.clear()
+        for task in list(self._tasks):
+            self._cancel_task(task)
+
+    def wait_for_done(self: QObject, msecs: int = -1) -> bool:
+        """
+        Wait for all the tasks to be done.
+
+        Params
+        ------
+        msecs : int, optional
+            The timeout in milliseconds, negative to wait forever. Defaults to -1.
+
+        Returns
+        -------
+        bool
+            True if all the tasks are done, False on timeout.
+        """
+        deadline = None if msecs < 0 else time.monotonic() + msecs / 1000
+        while True:
+            remaining = -1 if deadline is None else max(0, int((deadline - time.monotonic()) * 1000))
+            if not self.pool.waitForDone(remaining):
+                return False
+            if not self._serial:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            # deliver the done signals starting the waiting serial tasks
+            QCoreApplication.processEvents()
+
+    def _cancel_task(self: QObject, task: ONCatTask) -> None:
+        """Cancel a task, removing it from the queue if it has not started yet"""
+        task.cancel()
+        if self.pool.tryTake(task) or self._unqueue(task):
+            # the task will never run, report it from here instead
+            task.signals.post("cancelled")
+            task.signals.post("done")
+
+    def _unqueue(self: QObject, task: ONCatTask) -> bool:
+        """Remove a task waiting for the previous tasks of its serial key, returns True if found"""
+        for queue in self._serial.values():
+            for index, (waiting, _) in enumerate(queue[1:], start=1):
+                if waiting is task:
+                    del queue[index]
+                    return True
+        return False
+
+    def _forget(self: QObject, task: ONCatTask, group: str, serial: object = None) -> None:
+        """Drop the references to a task once it is done, starting the next task of its serial key"""
+        if task in self._tasks:
+            self._tasks.remove(task)
+        if group is not None and self._groups.get(group) is task:
+            del self._groups[group]
+        queue = self._serial.get(serial) if serial is not None else None
+        if queue and queue[0][0] is task:
+            queue.pop(0)
+            if queue:
+                self.pool.start(*queue[0])
+            else:
+                del self._serial[serial]
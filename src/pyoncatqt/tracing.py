@@ -0,0 +1,300 @@
+"""Module providing optional tracing spans around the login, token and agent calls
+
+Tracing is disabled by default and ``span`` then returns a shared no-op span.
+It is enabled by setting a tracer, either the JSON-lines tracer of this module::
+
+    from pyoncatqt import tracing
+
+    tracing.enable_tracing("pyoncatqt_trace.jsonl")
+
+or an OpenTelemetry tracer::
+
+    from opentelemetry import trace
+
+    tracing.set_tracer(trace.get_tracer("pyoncatqt"))
+
+Setting the ``PYONCATQT_TRACE_FILE`` environment variable enables the JSON-lines tracer on import.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import pyoncat
+
+TRACE_FILE_ENV = "PYONCATQT_TRACE_FILE"
+
+_tracer = None
+_local = threading.local()
+
+
+class _NoOpSpan:
+    """Span used when tracing is disabled, doing nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self: "_NoOpSpan") -> "_NoOpSpan":
+        return self
+
+    def __exit__(self: "_NoOpSpan", *exc_info: List[Any]) -> bool:
+        return False
+
+    def set_attribute(self: "_NoOpSpan", key: str, value: object) -> None:
+        """Ignore the attribute"""
+
+    def record_exception(self: "_NoOpSpan", exception: BaseException) -> None:
+        """Ignore the exception"""
+
+
+NOOP_SPAN = _NoOpSpan()
+
+
+class Span:
+    """
+    A span recorded by the JSONLinesTracer.
+
+    Attributes
+    ----------
+    name : str
+        The name of the span.
+    attributes : Dict[str, Any]
+        The attributes of the span.
+    """
+
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "start_time", "error")
+
+    def __init__(self: "Span", name: str, attributes: Dict[str, Any], parent: "Span" = None) -> None:
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.start_time = time.time()
+        self.error = None
+
+    def set_attribute(self: "Span", key: str, value: object) -> None:
+        """Set an attribute of the span"""
+        self.attributes[key] = value
+
+    def record_exception(self: "Span", exception: BaseException) -> None:
+        """Record an exception raised during the span"""
+        self.error = f"{type(exception).__name__}: {exception}"
+
+
+class JSONLinesTracer:
+    """
+    Tracer writing one JSON object per finished span to a file.
+
+    It provides the ``start_as_current_span`` method of OpenTelemetry tracers used by this package.
+
+    Params
+    ------
+    path : str
+        The file the spans are appended to.
+    """
+
+    def __init__(self: "JSONLinesTracer", path: str) -> None:
+        self.path = os.path.abspath(path)
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self._file = open(self.path, "a", encoding="UTF-8")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def start_as_current_span(self: "JSONLinesTracer", name: str, attributes: Dict[str, Any] = None) -> Iterator[Span]:
+        """
+        Start a span, nested in the current span of the thread.
+
+        Params
+        ------
+        name : str
+            The name of the span.
+        attributes : Dict[str, Any], optional
+            The initial attributes of the span.
+
+        Yields
+        ------
+        Span
+            The span, attributes can be added while it is active.
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+        current = Span(name, attributes, stack[-1] if stack else None)
+        stack.append(current)
+        start = time.perf_counter()
+        try:
+            yield current
+        except BaseException as exception:
+            current.record_exception(exception)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            self._export(current, duration)
+
+    def close(self: "JSONLinesTracer") -> None:
+        """Close the trace file"""
+        with self._lock:
+            self._file.close()
+
+    def _export(self: "JSONLinesTracer", span: Span, duration: float) -> None:
+        """Write a finished span to the file"""
+        record = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start_time": span.start_time,
+            "duration": duration,
+            "thread": threading.current_thread().name,
+            "status": "ERROR" if span.error else "OK",
+            "error": span.error,
+            "attributes": span.attributes,
+        }
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+
+def set_tracer(tracer: object) -> None:
+    """
+    Set the tracer used for the spans.
+
+    Params
+    ------
+    tracer : object
+        An object providing ``start_as_current_span(name, attributes=None)``, e.g. an OpenTelemetry tracer
+        or a JSONLinesTracer. None disables tracing.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> object:
+    """
+    Get the tracer used for the spans.
+
+    Returns
+    -------
+    object
+        The tracer, None if tracing is disabled.
+    """
+    return _tracer
+
+
+def is_enabled() -> bool:
+    """
+    Check if tracing is enabled.
+
+    Returns
+    -------
+    bool
+        True if a tracer is set, False otherwise.
+    """
+    return _tracer is not None
+
+
+def enable_tracing(path: str) -> JSONLinesTracer:
+    """
+    Trace to a JSON-lines file.
+
+    Params
+    ------
+    path : str
+        The file the spans are appended to.
+
+    Returns
+    -------
+    JSONLinesTracer
+        The tracer in use.
+    """
+    disable_tracing()
+    tracer = JSONLinesTracer(path)
+    set_tracer(tracer)
+    return tracer
+
+
+def disable_tracing() -> None:
+    """Stop tracing, closing the JSON-lines file if any"""
+    tracer = _tracer
+    set_tracer(None)
+    if isinstance(tracer, JSONLinesTracer):
+        tracer.close()
+
+
+def span(name: str, **attributes: Dict[str, Any]) -> object:
+    """
+    Start a span around a block of code.
+
+    Params
+    ------
+    name : str
+        The name of the span.
+    **attributes : Dict[str, Any], optional
+        The initial attributes of the span.
+
+    Returns
+    -------
+    object
+        A context manager yielding the span, a shared no-op span if tracing is disabled.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return _active_span(_tracer, name, attributes)
+
+
+@contextmanager
+def _active_span(tracer: object, name: str, attributes: Dict[str, Any]) -> Iterator[Any]:
+    """Start a span with the tracer, keeping track of the active span names of the thread"""
+    names = _local.__dict__.setdefault("names", [])
+    names.append(name)
+    try:
+        with tracer.start_as_current_span(name, attributes=attributes) as current:
+            yield current
+    finally:
+        names.pop()
+
+
+def in_span(name: str) -> bool:
+    """
+    Check if a span is active in the current thread.
+
+    Params
+    ------
+    name : str
+        The name of the span.
+
+    Returns
+    -------
+    bool
+        True if the span is active, False otherwise or if tracing is disabled.
+    """
+    return name in _local.__dict__.get("names", ())
+
+
+class TracedONCat(pyoncat.ONCat):
+    """
+    pyoncat.ONCat agent recording a span for each request when tracing is enabled.
+
+    It wraps ``pyoncat.ONCat._call_method``, the single method all the pyoncat 2 requests go through;
+    the pyoncat version is bounded accordingly in the package requirements.
+    """
+
+    def _call_method(self: pyoncat.ONCat, method: str, url: str, data: object, **kwargs: Dict[str, Any]) -> object:
+        if _tracer is None:
+            return super()._call_method(method, url, data, **kwargs)
+        with span("pyoncatqt.agent.request", **{"http.method": method.upper(), "endpoint": url}) as current:
+            result = super()._call_method(method, url, data, **kwargs)
+            if isinstance(result, list):
+                current.set_attribute("records", len(result))
+            return result
+
+
+if os.environ.get(TRACE_FILE_ENV):
+    enable_tracing(os.environ[TRACE_FILE_ENV])
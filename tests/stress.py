@@ -0,0 +1,489 @@
+"""Module to load test many ONCatLogin/ONCatLoginDialog instances against a local mock ONCat
+
+Run it headless from the repository root with::
+
+    python -m tests.stress --count 10 100 500 --latency 0.01
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import pyoncat
+from qtpy.QtCore import QCoreApplication, QEvent
+from qtpy.QtWidgets import QApplication, QWidget
+
+import pyoncatqt.configuration
+import pyoncatqt.login
+from pyoncatqt.login import ONCatLogin, ONCatLoginDialog, clear_shared_resources
+
+FACILITIES = [{"id": "SNS", "name": "SNS"}, {"id": "HFIR", "name": "HFIR"}]
+
+
+class MockONCatServer:
+    """
+    Minimal ONCat server counting the requests it receives.
+
+    Every request waits ``latency`` seconds before being answered. ``/oauth/token`` returns a new token,
+    ``/api/facilities`` the SNS and HFIR facilities and any other ``/api`` path an empty list.
+
+    Params
+    ------
+    latency : float, optional
+        The delay in seconds added to every request. Defaults to 0.
+
+    Attributes
+    ----------
+    url : str
+        The base URL of the server, available once started.
+    requests : Dict[str, int]
+        The number of requests received per path.
+    """
+
+    def __init__(self: "MockONCatServer", latency: float = 0.0) -> None:
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self: "MockONCatServer") -> str:
+        """The base URL of the running server"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self: "MockONCatServer") -> int:
+        """The total number of requests received"""
+        with self._lock:
+            return sum(self.requests.values())
+
+    def reset(self: "MockONCatServer") -> None:
+        """Reset the request counters"""
+        with self._lock:
+            self.requests.clear()
+
+    def start(self: "MockONCatServer") -> "MockONCatServer":
+        """Start serving in a background thread"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler answering with canned ONCat responses"""
+
+            def do_GET(self: BaseHTTPRequestHandler) -> None:
+                path = server.record(self.path)
+                self.reply(FACILITIES if path.rstrip("/").endswith("/facilities") else [])
+
+            def do_POST(self: BaseHTTPRequestHandler) -> None:
+                server.record(self.path)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.reply(new_token())
+
+            def reply(self: BaseHTTPRequestHandler, content: object) -> None:
+                body = json.dumps(content).encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self: BaseHTTPRequestHandler, *args: List[object]) -> None:
+                """Keep the load test output quiet"""
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self: "MockONCatServer") -> None:
+        """Stop the server"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def record(self: "MockONCatServer", path: str) -> str:
+        """Count a request and apply the latency, returns the path without query"""
+        path = urlsplit(path).path
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        return path
+
+    def __enter__(self: "MockONCatServer") -> "MockONCatServer":
+        return self.start()
+
+    def __exit__(self: "MockONCatServer", *exc_info: List[object]) -> None:
+        self.stop()
+
+
+def new_token() -> dict:
+    """
+    Create a bearer token valid for an hour.
+
+    Returns
+    -------
+    dict
+        The token dictionary.
+    """
+    return {
+        "access_token": "load-test-access-token",
+        "refresh_token": "load-test-refresh-token",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "expires_at": time.time() + 3600,
+    }
+
+
+class LoadTestReport:
+    """
+    Result of a load test run.
+
+    Attributes
+    ----------
+    widget : str
+        The widget created, "login" or "dialog".
+    count : int
+        The number of widgets created.
+    requests : Dict[str, int]
+        The number of requests received by the mock ONCat per path.
+    probes : int
+        The number of connection probes (facility requests).
+    token_reads : int
+        The number of times a token was read from file.
+    dialogs : int
+        The number of ONCatLoginDialog created.
+    wall_time : float
+        The time in seconds taken to create the widgets, measured without tracemalloc.
+    peak_memory : int
+        The peak of the Python heap (tracemalloc) while creating the widgets, in bytes, measured in a separate pass.
+        It does not include the C++ memory of the Qt widgets.
+    retained_memory : int
+        The Python heap (tracemalloc) still held by the widgets once created, in bytes.
+    resident_memory : int
+        The growth of the process resident memory while creating the widgets, in bytes, including the C++ memory
+        of the Qt widgets. None if the platform does not report it.
+    peak_resident_memory : int
+        The peak resident memory of the process at the end of the run, in bytes. None if the platform does not
+        report it.
+    """
+
+    def __init__(
+        self: "LoadTestReport",
+        widget: str,
+        count: int,
+        requests: Dict[str, int],
+        token_reads: int,
+        dialogs: int,
+        wall_time: float,
+        peak_memory: int,
+        retained_memory: int,
+        resident_memory: int = None,
+        peak_resident_memory: int = None,
+    ) -> None:
+        self.widget = widget
+        self.count = count
+        self.requests = dict(requests)
+        self.token_reads = token_reads
+        self.dialogs = dialogs
+        self.wall_time = wall_time
+        self.peak_memory = peak_memory
+        self.retained_memory = retained_memory
+        self.resident_memory = resident_memory
+        self.peak_resident_memory = peak_resident_memory
+
+    @property
+    def request_count(self: "LoadTestReport") -> int:
+        """The total number of requests"""
+        return sum(self.requests.values())
+
+    @property
+    def probes(self: "LoadTestReport") -> int:
+        """The number of connection probes"""
+        return sum(count for path, count in self.requests.items() if path.rstrip("/").endswith("/facilities"))
+
+    @property
+    def time_per_widget(self: "LoadTestReport") -> float:
+        """The average creation time of a widget in seconds"""
+        return self.wall_time / self.count if self.count else 0.0
+
+    @property
+    def memory_per_widget(self: "LoadTestReport") -> float:
+        """The average peak memory per widget in bytes"""
+        return self.peak_memory / self.count if self.count else 0.0
+
+    @property
+    def footprint_per_widget(self: "LoadTestReport") -> float:
+        """The average Python heap retained per widget in bytes"""
+        return self.retained_memory / self.count if self.count else 0.0
+
+    @property
+    def resident_per_widget(self: "LoadTestReport") -> float:
+        """The average growth of the resident memory per widget in bytes, None if not reported"""
+        if self.resident_memory is None:
+            return None
+        return self.resident_memory / self.count if self.count else 0.0
+
+    def as_dict(self: "LoadTestReport") -> dict:
+        """
+        Convert the report to a dictionary.
+
+        Returns
+        -------
+        dict
+            The report values, including the derived ones.
+        """
+        return {
+            "widget": self.widget,
+            "count": self.count,
+            "requests": self.requests,
+            "request_count": self.request_count,
+            "probes": self.probes,
+            "token_reads": self.token_reads,
+            "dialogs": self.dialogs,
+            "wall_time": self.wall_time,
+            "time_per_widget": self.time_per_widget,
+            "peak_memory": self.peak_memory,
+            "memory_per_widget": self.memory_per_widget,
+            "retained_memory": self.retained_memory,
+            "footprint_per_widget": self.footprint_per_widget,
+            "resident_memory": self.resident_memory,
+            "resident_per_widget": self.resident_per_widget,
+            "peak_resident_memory": self.peak_resident_memory,
+        }
+
+
+@contextmanager
+def _count_token_reads() -> Iterator[List[int]]:
+    """Count the tokens read from file, the count is the single item of the yielded list"""
+    reads = [0]
+    lock = threading.Lock()
+    read = pyoncatqt.login.read_token_file
+
+    def counting_read(token_path: str) -> dict:
+        with lock:
+            reads[0] += 1
+        return read(token_path)
+
+    pyoncatqt.login.read_token_file = counting_read
+    try:
+        yield reads
+    finally:
+        pyoncatqt.login.read_token_file = read
+
+
+def _application() -> QApplication:
+    """Return the running application, creating an offscreen one if needed"""
+    app = QApplication.instance()
+    if app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QApplication([])
+    return app
+
+
+@contextmanager
+def _environment(server: MockONCatServer, key: str, client_id: str, connected: bool) -> Iterator[str]:
+    """Point the configuration and the home directory to a temporary directory for the run"""
+    saved_config = pyoncatqt.configuration.CONFIG_PATH_FILE
+    # the mock ONCat is served over plain http, which oauthlib refuses by default
+    saved_environ = {name: os.environ.get(name) for name in ("HOME", "OAUTHLIB_INSECURE_TRANSPORT")}
+    with tempfile.TemporaryDirectory() as home:
+        config_path = os.path.join(home, "configuration.ini")
+        with open(config_path, "w", encoding="UTF-8") as config:
+            config.write(f"[login.oncat]\noncat_url = {server.url}\n{key}_id = {client_id}\n")
+        if connected:
+            os.makedirs(os.path.join(home, ".pyoncatqt"))
+            with open(os.path.join(home, ".pyoncatqt", f"{key}_token.json"), "w", encoding="UTF-8") as token:
+                json.dump(new_token(), token)
+        pyoncatqt.configuration.CONFIG_PATH_FILE = config_path
+        os.environ["HOME"] = home
+        os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+        try:
+            yield home
+        finally:
+            pyoncatqt.configuration.CONFIG_PATH_FILE = saved_config
+            for name, value in saved_environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def _resident_memory() -> int:
+    """Return the current resident memory of the process in bytes, None if unknown (e.g. not on Linux)"""
+    try:
+        with open("/proc/self/statm", encoding="UTF-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_resident_memory() -> int:
+    """Return the peak resident memory of the process in bytes, None if unknown (e.g. on Windows)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kibibytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _dialog_count(app: QApplication) -> int:
+    """Count the ONCatLoginDialog alive in the application"""
+    return sum(isinstance(widget, ONCatLoginDialog) for widget in app.allWidgets())
+
+
+def _create_widgets(count: int, widget: str, key: str, agent: pyoncat.ONCat) -> List[QWidget]:
+    """Create the widgets of a load test run"""
+    if widget == "login":
+        return [ONCatLogin(key=key) for _ in range(count)]
+    return [ONCatLoginDialog(agent=agent) for _ in range(count)]
+
+
+def _delete_widgets(widgets: List[QWidget]) -> None:
+    """Delete the widgets of a load test run and the resources they share"""
+    for instance in widgets:
+        instance.deleteLater()
+    clear_shared_resources()
+    QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+
+
+def run_load_test(
+    count: int,
+    widget: str = "login",
+    latency: float = 0.0,
+    connected: bool = True,
+    key: str = "loadtest",
+    client_id: str = "0123456789abcdef",
+) -> LoadTestReport:
+    """
+    Create ``count`` widgets against a local mock ONCat and measure the cost.
+
+    The widgets are created twice: a first pass counts the requests and times the creation,
+    a second pass traces the memory with tracemalloc.
+
+    Params
+    ------
+    count : int, required
+        The number of widgets to create.
+    widget : str, optional
+        "login" to create ONCatLogin widgets or "dialog" to create ONCatLoginDialog sharing an agent.
+        Defaults to "login".
+    latency : float, optional
+        The delay in seconds added to every request by the mock ONCat. Defaults to 0.
+    connected : bool, optional
+        Store a valid token before the run, otherwise the widgets start disconnected. Defaults to True.
+    key : str, optional
+        The application key of the ONCatLogin widgets. Defaults to "loadtest".
+    client_id : str, optional
+        The ONCat client ID written in the configuration. Defaults to a dummy ID.
+
+    Returns
+    -------
+    LoadTestReport
+        The request counts, wall time, Python heap and resident memory of the run.
+    """
+    if widget not in ("login", "dialog"):
+        raise ValueError(f"Invalid widget {widget}. Expected 'login' or 'dialog'.")
+
+    app = _application()
+    with (
+        MockONCatServer(latency) as server,
+        _environment(server, key, client_id, connected),
+        _count_token_reads() as token_reads,
+    ):
+        agent = None
+        if widget == "dialog":
+            agent = pyoncat.ONCat(server.url, client_id=client_id, flow=pyoncat.RESOURCE_OWNER_CREDENTIALS_FLOW)
+
+        # time the creation without tracemalloc, its overhead grows with the number of allocations,
+        # tracemalloc also holds its traces in the resident memory
+        dialogs_before = _dialog_count(app)
+        resident_before = _resident_memory()
+        start = time.perf_counter()
+        widgets = _create_widgets(count, widget, key, agent)
+        wall_time = time.perf_counter() - start
+        resident_after = _resident_memory()
+        resident_memory = None if resident_before is None else resident_after - resident_before
+        requests = dict(server.requests)
+        reads = token_reads[0]
+        dialogs = _dialog_count(app) - dialogs_before
+        _delete_widgets(widgets)
+
+        # measure the memory in a second pass, starting again without shared resources
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        widgets = _create_widgets(count, widget, key, agent)
+        retained_memory, peak_memory = (memory - baseline for memory in tracemalloc.get_traced_memory())
+        if not was_tracing:
+            tracemalloc.stop()
+        _delete_widgets(widgets)
+
+    return LoadTestReport(
+        widget=widget,
+        count=count,
+        requests=requests,
+        token_reads=reads,
+        dialogs=dialogs,
+        wall_time=wall_time,
+        peak_memory=peak_memory,
+        retained_memory=retained_memory,
+        resident_memory=resident_memory,
+        peak_resident_memory=_peak_resident_memory(),
+    )
+
+
+def main(argv: List[str] = None) -> None:
+    """Run load tests from the command line and print one report per count"""
+    parser = argparse.ArgumentParser(description="Load test ONCat widgets against a local mock ONCat.")
+    parser.add_argument("--count", type=int, nargs="+", default=[1, 10, 100], help="number of widgets per run")
+    parser.add_argument("--widget", choices=["login", "dialog"], default="login", help="widget to create")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock ONCat latency per request in seconds")
+    parser.add_argument("--disconnected", action="store_true", help="start without a stored token")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON lines")
+    args = parser.parse_args(argv)
+
+    for count in args.count:
+        report = run_load_test(count, widget=args.widget, latency=args.latency, connected=not args.disconnected)
+        if args.json:
+            print(json.dumps(report.as_dict()))
+        else:
+            print(
+                f"{report.widget} x{report.count}: {report.request_count} requests ({report.probes} probes), "
+                f"{report.token_reads} token reads, {report.dialogs} dialogs, "
+                f"{report.wall_time:.3f} s ({report.time_per_widget * 1000:.2f} ms/widget), "
+                f"Python heap peak {report.peak_memory / 1024:.1f} KiB "
+                f"({report.memory_per_widget / 1024:.2f} KiB/widget), "
+                f"retained {report.retained_memory / 1024:.1f} KiB "
+                f"({report.footprint_per_widget / 1024:.2f} KiB/widget)"
+            )
+            if report.resident_memory is not None:
+                print(
+                    f"    resident +{report.resident_memory / 1024:.1f} KiB "
+                    f"({report.resident_per_widget / 1024:.2f} KiB/widget), "
+                    f"process peak {report.peak_resident_memory / 1024 / 1024:.1f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
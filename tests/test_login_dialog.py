@@ -1,16 +1,25 @@
 import functools
 import json
 import os
+import threading
 from unittest.mock import MagicMock, patch
 
 import oauthlib
 import pyoncat
 import pytest
 from qtpy import QtCore
-from qtpy.QtWidgets import QApplication, QDialog, QLineEdit, QPushButton
+from qtpy.QtWidgets import QApplication, QDialog, QLineEdit, QPushButton, QWidget
 
 from pyoncatqt.configuration import get_data
-from pyoncatqt.login import ONCatLogin, ONCatLoginDialog
+from pyoncatqt.login import (
+    ONCatLogin,
+    ONCatLoginDialog,
+    TokenStore,
+    clear_shared_resources,
+    get_error_dialog,
+    get_shared_agent,
+    write_token_file,
+)
 
 
 def check_status(login_status: bool) -> None:
@@ -213,3 +222,98 @@ def test_write_token(qtbot: pytest.fixture, token_path: pytest.fixture) -> None:
     widget.write_token(actual_token)
     with open(token_path, "r") as f:
         assert f.read() == json.dumps(actual_token)
+
+
+def test_shared_agent_and_dialog(qtbot: pytest.fixture) -> None:
+    first = ONCatLogin(key="test")
+    second = ONCatLogin(key="test")
+    other = ONCatLogin(client_id="12cnfjejsfsdf3456789ab")
+    for widget in (first, second, other):
+        qtbot.addWidget(widget)
+
+    assert first.agent is second.agent
+    assert first.agent is not other.agent
+    assert first.login_dialog is second.login_dialog
+    assert first.login_dialog is not other.login_dialog
+    assert first.login_dialog.error is other.login_dialog.error is get_error_dialog()
+
+    agent = first.agent
+    clear_shared_resources()
+    QApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+    # the existing widgets use the new agent and dialog
+    new = ONCatLogin(key="test")
+    qtbot.addWidget(new)
+    assert new.agent is not agent
+    assert first.agent is new.agent
+    assert first.login_dialog is new.login_dialog
+    assert first.login_dialog.windowTitle() == "Use U/XCAM to connect to OnCat"
+
+
+def test_shared_dialog_options(qtbot: pytest.fixture) -> None:
+    default = ONCatLogin(key="test")
+    custom = ONCatLogin(key="test", login_title="Custom title")
+    qtbot.addWidget(default)
+    qtbot.addWidget(custom)
+    assert default.agent is custom.agent
+    assert default.login_dialog is not custom.login_dialog
+    assert custom.login_dialog.windowTitle() == "Custom title"
+    # options unknown to the dialog are not part of the key
+    assert ONCatLogin(key="test", parent=default, colors=["red"]).login_dialog is default.login_dialog
+
+
+def test_shared_dialog_parent(qtbot: pytest.fixture) -> None:
+    window = QWidget()
+    qtbot.addWidget(window)
+    first = ONCatLogin(key="test", parent=window)
+    dialog = first.login_dialog
+    assert dialog.parent() is window
+    assert dialog.isWindow()
+
+    # the dialog is deleted with its parent and created again on next use
+    window.deleteLater()
+    QApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+    second = ONCatLogin(key="test")
+    qtbot.addWidget(second)
+    assert second.login_dialog.parent() is second
+
+
+def test_shared_agent_token_store(token_path: pytest.fixture) -> None:
+    agent = get_shared_agent("https://oncat.test", "0123456489", token_path)
+    assert agent is get_shared_agent("https://oncat.test", "0123456489", token_path)
+    store = TokenStore(token_path)
+    assert not hasattr(store, "__dict__")
+    with open(token_path, "r") as f:
+        assert store.read() == json.load(f)
+
+
+def test_overridden_token_callbacks(qtbot: pytest.fixture) -> None:
+    class KeyringLogin(ONCatLogin):
+        def read_token(self: ONCatLogin) -> dict:
+            reads.append(self)
+            return None
+
+    reads = []
+    shared = ONCatLogin(key="test")
+    widget = KeyringLogin(key="test")
+    qtbot.addWidget(shared)
+    qtbot.addWidget(widget)
+    # the agent of the subclass reads the token through the overridden method, it is not shared
+    assert reads == [widget]
+    assert widget.agent is not shared.agent
+    assert not widget.is_connected
+    assert reads == [widget, widget]
+
+
+def test_write_token_file_concurrent(tmp_path: pytest.fixture) -> None:
+    token_path = str(tmp_path / "token.json")
+    tokens = [{"access_token": "token" * index} for index in range(1, 9)]
+    threads = [threading.Thread(target=write_token_file, args=(token_path, token)) for token in tokens]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the file holds one whole token and no temporary file is left
+    with open(token_path, "r") as f:
+        assert json.load(f) in tokens
+    assert os.listdir(tmp_path) == ["token.json"]
+    assert os.stat(token_path).st_mode & 0o777 == 0o600
@@ -0,0 +1,212 @@
+import threading
+from unittest.mock import MagicMock
+
+import pyoncat
+import pytest
+
+import pyoncatqt.prefetch
+from pyoncatqt.login import ONCatLogin, ONCatLoginDialog, clear_shared_resources
+from pyoncatqt.prefetch import PrefetchQuery, get_prefetcher, prefetch_cache
+
+PREFETCH = [
+    PrefetchQuery("sns_instruments", "Instrument", facility="SNS"),
+    {"name": "experiments", "resource": "Experiment", "params": {"facility": "SNS", "instrument": "CNCS"}},
+]
+
+
+@pytest.fixture(autouse=True)
+def _clear_prefetch_cache() -> None:
+    yield
+    get_prefetcher().runner.wait_for_done(5000)
+    prefetch_cache.clear()
+
+
+@pytest.fixture
+def agent() -> MagicMock:
+    agent = MagicMock()
+    agent.Instrument.list.return_value = [{"name": "CNCS"}, {"name": "HYSPEC"}]
+    agent.Experiment.list.return_value = [{"id": "IPTS-1234"}]
+    return agent
+
+
+def test_prefetch_query(agent: pytest.fixture) -> None:
+    query = PrefetchQuery.from_value({"name": "instruments", "resource": "Instrument", "params": {"facility": "SNS"}})
+    assert query.run(agent) == [{"name": "CNCS"}, {"name": "HYSPEC"}]
+    agent.Instrument.list.assert_called_once_with(facility="SNS")
+    assert PrefetchQuery.from_value(query) is query
+    assert repr(query) == "PrefetchQuery('instruments', Instrument.list(facility='SNS'))"
+
+    with pytest.raises(ValueError, match="Invalid prefetch query"):
+        PrefetchQuery.from_value({"resource": "Instrument"})
+
+
+def test_prefetch_on_login(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    widget = ONCatLogin(key="test", prefetch=PREFETCH)
+    qtbot.addWidget(widget)
+    widget.agent = agent
+    assert widget.prefetched("sns_instruments") is None
+
+    completed = []
+    widget.prefetch_completed.connect(completed.append)
+    with qtbot.waitSignals([widget.prefetch_completed, widget.prefetch_completed], timeout=5000):
+        widget.update_connection_status()
+
+    assert sorted(completed) == ["experiments", "sns_instruments"]
+    assert widget.prefetched("sns_instruments") == [{"name": "CNCS"}, {"name": "HYSPEC"}]
+    assert widget.prefetched("experiments") == [{"id": "IPTS-1234"}]
+    agent.Experiment.list.assert_called_once_with(facility="SNS", instrument="CNCS")
+
+    # already connected, the queries are not run again
+    widget.update_connection_status()
+    get_prefetcher().runner.wait_for_done(5000)
+    assert agent.Instrument.list.call_count == 1
+
+
+def test_prefetch_shared_between_widgets(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    first = ONCatLogin(key="test", prefetch=PREFETCH)
+    second = ONCatLogin(key="test", prefetch=PREFETCH[:1])
+    for widget in (first, second):
+        qtbot.addWidget(widget)
+        widget.agent = agent
+
+    with qtbot.waitSignals([first.prefetch_completed, second.prefetch_completed], timeout=5000):
+        first.update_connection_status()
+        second.update_connection_status()
+    qtbot.waitUntil(lambda: first.prefetched("experiments") is not None, timeout=5000)
+
+    # the running query is not started twice
+    assert agent.Instrument.list.call_count == 1
+    assert second.prefetched("sns_instruments") == first.prefetched("sns_instruments")
+
+    clear_shared_resources()
+    assert second.prefetched("sns_instruments", default=[]) == []
+
+
+def test_prefetch_failed(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    error = RuntimeError("server error")
+    agent.Experiment.list.side_effect = error
+    widget = ONCatLogin(key="test", prefetch=PREFETCH)
+    qtbot.addWidget(widget)
+    widget.agent = agent
+
+    with qtbot.waitSignal(widget.prefetch_failed, timeout=5000) as blocker:
+        widget.update_connection_status()
+    assert blocker.args == ["experiments", error]
+    assert widget.prefetched("experiments") is None
+
+
+def test_no_prefetch_when_disconnected(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    agent.Facility.list.side_effect = RuntimeError("not connected")
+    widget = ONCatLogin(key="test", prefetch=PREFETCH)
+    qtbot.addWidget(widget)
+    widget.agent = agent
+    widget.update_connection_status()
+    assert get_prefetcher().runner.active_count == 0
+    agent.Instrument.list.assert_not_called()
+
+
+def test_prefetch_concurrent(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    # each query waits for the other one, they only complete if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def query(**_: dict) -> list:
+        barrier.wait()
+        return []
+
+    agent.Instrument.list.side_effect = query
+    agent.Experiment.list.side_effect = query
+    widget = ONCatLogin(key="test", prefetch=PREFETCH)
+    qtbot.addWidget(widget)
+    widget.agent = agent
+    failed = []
+    widget.prefetch_failed.connect(lambda name, _: failed.append(name))
+    # enough threads to run the queries concurrently
+    pool = get_prefetcher().runner.pool
+    max_threads = pool.maxThreadCount()
+    pool.setMaxThreadCount(4)
+    try:
+        with qtbot.waitSignals([widget.prefetch_completed, widget.prefetch_completed], timeout=5000):
+            widget.update_connection_status()
+    finally:
+        pool.setMaxThreadCount(max_threads)
+    assert failed == []
+    assert widget.prefetched("experiments") == []
+
+
+def test_prefetch_invalidated(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    widget = ONCatLogin(key="test", prefetch=PREFETCH[:1])
+    qtbot.addWidget(widget)
+    widget.agent = agent
+    with qtbot.waitSignal(widget.prefetch_completed, timeout=5000):
+        widget.update_connection_status()
+    assert widget.prefetched("sns_instruments") is not None
+
+    # a network error keeps the results
+    agent.Facility.list.side_effect = RuntimeError("network error")
+    widget.update_connection_status()
+    assert widget.prefetched("sns_instruments") is not None
+
+    # the results are dropped once the session ended and fetched again once connected
+    agent.Facility.list.side_effect = pyoncat.LoginRequiredError
+    widget.update_connection_status()
+    assert widget.prefetched("sns_instruments") is None
+    agent.Facility.list.side_effect = None
+    with qtbot.waitSignal(widget.prefetch_completed, timeout=5000):
+        widget.update_connection_status()
+    assert agent.Instrument.list.call_count == 2
+
+    # a new login drops the results of the previous session
+    ONCatLoginDialog(agent=agent).accept()
+    assert widget.prefetched("sns_instruments") is None
+    with qtbot.waitSignal(widget.prefetch_completed, timeout=5000):
+        widget.update_connection_status()
+    assert agent.Instrument.list.call_count == 3
+
+
+def test_prefetch_cache_discard(agent: pytest.fixture) -> None:
+    prefetch_cache.set(agent, "instruments", [])
+    assert (agent, "instruments") in prefetch_cache
+    prefetch_cache.discard(agent)
+    assert (agent, "instruments") not in prefetch_cache
+    assert prefetch_cache.age(agent, "instruments") is None
+
+
+def test_invalidated_queries_not_sent(qtbot: pytest.fixture, agent: pytest.fixture) -> None:
+    widget = ONCatLogin(key="test", prefetch=PREFETCH)
+    qtbot.addWidget(widget)
+    widget.agent = agent
+    prefetcher = get_prefetcher()
+    pool = prefetcher.runner.pool
+    max_threads = pool.maxThreadCount()
+    pool.setMaxThreadCount(1)
+    release = threading.Event()
+    try:
+        # the queries wait for a busy worker, a new login cancels them before they start
+        prefetcher.runner.submit(release.wait, 5)
+        widget.update_connection_status()
+        ONCatLoginDialog(agent=agent).accept()
+        release.set()
+        assert prefetcher.runner.wait_for_done(5000)
+    finally:
+        pool.setMaxThreadCount(max_threads)
+    agent.Instrument.list.assert_not_called()
+    agent.Experiment.list.assert_not_called()
+
+    # the queries of the new session do not wait for the cancelled ones
+    with qtbot.waitSignals([widget.prefetch_completed, widget.prefetch_completed], timeout=5000):
+        widget.update_connection_status()
+    agent.Instrument.list.assert_called_once()
+
+
+def test_no_prefetcher_without_queries(qtbot: pytest.fixture, monkeypatch: pytest.fixture) -> None:
+    monkeypatch.setattr(pyoncatqt.prefetch, "_prefetcher", None)
+    widget = ONCatLogin(key="test")
+    qtbot.addWidget(widget)
+    agent = MagicMock()
+    agent.Facility.list.side_effect = pyoncat.InvalidRefreshTokenError
+    widget.agent = agent
+    widget.update_connection_status()
+    ONCatLoginDialog(agent=agent).accept()
+    clear_shared_resources()
+    # the prefetcher and its thread pool are only created by widgets declaring queries
+    assert get_prefetcher(create=False) is None
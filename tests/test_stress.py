@@ -0,0 +1,81 @@
+import json
+import urllib.request
+
+import pytest
+
+from tests.stress import MockONCatServer, main, run_load_test
+
+
+def test_mock_server_counts_requests() -> None:
+    with MockONCatServer() as server:
+        with urllib.request.urlopen(f"{server.url}/api/facilities?projection=name") as response:
+            facilities = json.load(response)
+        with urllib.request.urlopen(f"{server.url}/api/instruments") as response:
+            instruments = json.load(response)
+        assert [facility["id"] for facility in facilities] == ["SNS", "HFIR"]
+        assert instruments == []
+        assert server.requests == {"/api/facilities": 1, "/api/instruments": 1}
+        assert server.request_count == 2
+        server.reset()
+        assert server.request_count == 0
+
+
+@pytest.mark.usefixtures("qapp")
+def test_load_test_connected() -> None:
+    report = run_load_test(20)
+    assert report.count == 20
+    assert report.probes == report.request_count
+    # one probe per widget, the shared agent reads the token once
+    assert report.probes == report.count
+    assert report.token_reads == 1
+    # the login dialog is only created when connecting
+    assert report.dialogs == 0
+    assert report.wall_time > 0
+    assert report.peak_memory > 0
+    assert report.peak_resident_memory is None or report.peak_resident_memory > 0
+
+
+@pytest.mark.usefixtures("qapp")
+def test_load_test_disconnected() -> None:
+    report = run_load_test(20, connected=False)
+    # no token, the agent does not reach the server
+    assert report.request_count == 0
+    assert report.token_reads == report.count
+
+
+@pytest.mark.usefixtures("qapp")
+def test_load_test_dialogs() -> None:
+    report = run_load_test(50, widget="dialog")
+    assert report.dialogs == 50
+    assert report.request_count == 0
+    assert report.token_reads == 0
+
+
+@pytest.mark.usefixtures("qapp")
+def test_widget_footprint() -> None:
+    report = run_load_test(200)
+    # the agent, session and dialogs are shared, each widget only holds its own Qt children;
+    # this is the Python heap, the C++ memory of the Qt widgets is part of the resident memory
+    assert report.footprint_per_widget < 16 * 1024
+    assert report.retained_memory <= report.peak_memory
+
+
+@pytest.mark.usefixtures("qapp")
+def test_load_test_latency() -> None:
+    report = run_load_test(10, latency=0.02)
+    # every widget probes the server once, waiting for the injected latency
+    assert report.probes == 10
+    assert report.wall_time >= report.count * 0.02
+
+
+def test_load_test_invalid_widget() -> None:
+    with pytest.raises(ValueError, match="Invalid widget"):
+        run_load_test(1, widget="window")
+
+
+@pytest.mark.usefixtures("qapp")
+def test_main_json(capsys: pytest.fixture) -> None:
+    main(["--count", "1", "2", "--json"])
+    reports = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [report["count"] for report in reports] == [1, 2]
+    assert reports[1]["probes"] == reports[1]["requests"]["/api/facilities"]
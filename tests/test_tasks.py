@@ -0,0 +1,147 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from qtpy.QtCore import QThread
+
+from pyoncatqt.tasks import ONCatPagedTask, ONCatTaskRunner
+
+
+def test_submit_result_in_gui_thread(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner()
+    agent = MagicMock()
+    agent.Instrument.list.return_value = [{"name": "Instrument1"}]
+    gui_thread = QThread.currentThread()
+    threads = []
+
+    task = runner.submit(agent.Instrument.list, facility="SNS")
+    # the result is delivered even if the task completed before connecting
+    assert runner.wait_for_done(5000)
+    task.signals.finished.connect(lambda _: threads.append(QThread.currentThread()))
+    with qtbot.waitSignal(task.signals.finished, timeout=5000) as blocker:
+        pass
+
+    assert blocker.args == [[{"name": "Instrument1"}]]
+    agent.Instrument.list.assert_called_once_with(facility="SNS")
+    assert threads == [gui_thread]
+    qtbot.waitUntil(lambda: runner.active_count == 0, timeout=5000)
+
+
+def test_submit_failure(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner()
+    error = RuntimeError("server error")
+
+    def fail() -> None:
+        raise error
+
+    task = runner.submit(fail)
+    with qtbot.waitSignal(task.signals.failed, timeout=5000) as blocker:
+        pass
+    assert blocker.args == [error]
+
+
+def test_group_supersedes_previous_task(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner(max_threads=1)
+    release = threading.Event()
+    results = []
+
+    runner.submit(release.wait, 5)
+    stale = runner.submit(lambda: "stale", group="selection")
+    stale.signals.finished.connect(results.append)
+    latest = runner.submit(lambda: "latest", group="selection")
+    latest.signals.finished.connect(results.append)
+
+    assert stale.is_cancelled
+    assert not latest.is_cancelled
+
+    with qtbot.waitSignal(latest.signals.finished, timeout=5000):
+        release.set()
+    assert results == ["latest"]
+
+
+def test_cancel_running_task_discards_result(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def query() -> str:
+        started.set()
+        release.wait(5)
+        return "result"
+
+    task = runner.submit(query, group="selection")
+    task.signals.finished.connect(results.append)
+    assert started.wait(5)
+    with qtbot.waitSignal(task.signals.cancelled, timeout=5000):
+        runner.cancel("selection")
+        release.set()
+    assert results == []
+
+
+def test_cancel_all(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner(max_threads=1)
+    release = threading.Event()
+    running = runner.submit(release.wait, 5)
+    pending = runner.submit(lambda: "pending")
+
+    with qtbot.waitSignals([running.signals.cancelled, pending.signals.cancelled], timeout=5000):
+        runner.cancel_all()
+        release.set()
+    assert runner.wait_for_done(5000)
+    qtbot.waitUntil(lambda: runner.active_count == 0, timeout=5000)
+
+
+def test_submit_paged_progress(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner()
+    records = list(range(25))
+    progress = []
+
+    def fetch_page(page: int, page_size: int) -> list:
+        return records[page * page_size : (page + 1) * page_size]
+
+    task = ONCatPagedTask(fetch_page, page_size=10)
+    task.signals.progress.connect(lambda pages, count: progress.append((pages, count)))
+    with qtbot.waitSignal(task.signals.finished, timeout=5000) as blocker:
+        runner.start(task)
+
+    assert blocker.args == [records]
+    assert progress == [(1, 10), (2, 20), (3, 25)]
+
+
+def test_submit_paged_invalid_page_size() -> None:
+    runner = ONCatTaskRunner()
+    with pytest.raises(ValueError, match="Invalid page size"):
+        runner.submit_paged(lambda *_: [], page_size=0)
+
+
+def test_serial_tasks_run_one_at_a_time(qtbot: pytest.fixture) -> None:
+    runner = ONCatTaskRunner(max_threads=4)
+    agent = MagicMock()
+    started = threading.Event()
+    release = threading.Event()
+    running = []
+    calls = []
+
+    def query(name: str) -> None:
+        running.append(name)
+        calls.append((name, len(running)))
+        started.set()
+        release.wait(5)
+        running.remove(name)
+
+    runner.submit(query, "first", serial=agent)
+    assert started.wait(5)
+    runner.submit(query, "second", serial=agent)
+    stale = runner.submit(query, "stale", serial=agent, group="selection")
+    runner.submit(query, "last", serial=agent)
+    # a waiting task does not hold a worker thread
+    assert runner.pool.activeThreadCount() == 1
+    with qtbot.waitSignal(stale.signals.cancelled, timeout=5000):
+        runner.cancel("selection")
+
+    release.set()
+    assert runner.wait_for_done(5000)
+    # the tasks ran in order, one at a time, and the cancelled one never ran
+    assert calls == [("first", 1), ("second", 1), ("last", 1)]
+    qtbot.waitUntil(lambda: runner.active_count == 0, timeout=5000)
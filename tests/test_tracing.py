@@ -0,0 +1,145 @@
+import inspect
+import json
+from unittest.mock import MagicMock
+
+import pyoncat
+import pytest
+
+from pyoncatqt import tracing
+from pyoncatqt.login import ONCatLogin, ONCatLoginDialog, TokenStore
+from tests.stress import MockONCatServer
+
+
+@pytest.fixture(autouse=True)
+def _disable_tracing() -> None:
+    yield
+    tracing.disable_tracing()
+
+
+@pytest.fixture
+def trace_path(tmp_path: pytest.fixture) -> str:
+    return str(tmp_path / "trace" / "spans.jsonl")
+
+
+def read_spans(trace_path: str) -> list:
+    with open(trace_path, encoding="UTF-8") as trace:
+        return [json.loads(line) for line in trace]
+
+
+def test_disabled_by_default() -> None:
+    assert not tracing.is_enabled()
+    with tracing.span("pyoncatqt.test", endpoint="api/facilities") as current:
+        current.set_attribute("bytes", 10)
+        current.record_exception(RuntimeError())
+    assert current is tracing.NOOP_SPAN
+    assert not tracing.in_span("pyoncatqt.test")
+
+
+def test_json_lines_tracer(trace_path: pytest.fixture) -> None:
+    tracer = tracing.enable_tracing(trace_path)
+    assert tracing.get_tracer() is tracer
+
+    with tracing.span("outer", endpoint="api/instruments") as outer:
+        assert tracing.in_span("outer")
+        outer.set_attribute("records", 3)
+        with pytest.raises(RuntimeError), tracing.span("inner"):
+            raise RuntimeError("server error")
+    assert not tracing.in_span("outer")
+    tracing.disable_tracing()
+
+    inner, outer = read_spans(trace_path)
+    assert outer["name"] == "outer"
+    assert outer["attributes"] == {"endpoint": "api/instruments", "records": 3}
+    assert outer["status"] == "OK"
+    assert outer["parent_id"] is None
+    assert inner["name"] == "inner"
+    assert inner["status"] == "ERROR"
+    assert inner["error"] == "RuntimeError: server error"
+    assert inner["parent_id"] == outer["span_id"]
+    assert inner["trace_id"] == outer["trace_id"]
+    assert inner["duration"] >= 0
+
+
+def test_external_tracer() -> None:
+    tracer = MagicMock()
+    tracing.set_tracer(tracer)
+    with tracing.span("pyoncatqt.test", endpoint="api/facilities"):
+        pass
+    tracer.start_as_current_span.assert_called_once_with("pyoncatqt.test", attributes={"endpoint": "api/facilities"})
+
+
+def test_login_and_token_spans(qtbot: pytest.fixture, tmp_path: pytest.fixture, trace_path: pytest.fixture) -> None:
+    widget = ONCatLogin(key="test")
+    qtbot.addWidget(widget)
+    widget.agent = MagicMock()
+    widget.token_path = str(tmp_path / "token.json")
+    dialog = ONCatLoginDialog(agent=MagicMock())
+    qtbot.addWidget(dialog)
+    tracing.enable_tracing(trace_path)
+
+    assert widget.is_connected
+    widget.write_token({"access_token": "token"})
+    assert widget.read_token() == {"access_token": "token"}
+    dialog.accept()
+    tracing.disable_tracing()
+
+    spans = {span["name"]: span for span in read_spans(trace_path)}
+    assert spans["pyoncatqt.is_connected"]["attributes"]["connected"] is True
+    content_length = len(json.dumps({"access_token": "token"}))
+    assert spans["pyoncatqt.token.write"]["attributes"]["bytes"] == content_length
+    assert spans["pyoncatqt.token.read"]["attributes"]["bytes"] == content_length
+    assert spans["pyoncatqt.token.read"]["attributes"]["token.found"] is True
+    assert spans["pyoncatqt.login"]["attributes"]["login.success"] is True
+
+
+def test_token_refresh_span(tmp_path: pytest.fixture, trace_path: pytest.fixture) -> None:
+    store = TokenStore(str(tmp_path / "token.json"))
+    tracing.enable_tracing(trace_path)
+    with tracing.span("pyoncatqt.login"):
+        store.write({"access_token": "login"})
+    store.write({"access_token": "refreshed"})
+    tracing.disable_tracing()
+
+    spans = [(span["name"], span["attributes"].get("refresh")) for span in read_spans(trace_path)]
+    assert spans == [("pyoncatqt.token.write", False), ("pyoncatqt.login", None), ("pyoncatqt.token.write", True)]
+
+
+def test_widget_token_refresh_span(qtbot: pytest.fixture, tmp_path: pytest.fixture, trace_path: pytest.fixture) -> None:
+    class KeyringLogin(ONCatLogin):
+        def read_token(self: ONCatLogin) -> dict:
+            return None
+
+    # the widget's own agent saves the token through ONCatLogin.write_token
+    widget = KeyringLogin(key="test")
+    qtbot.addWidget(widget)
+    widget.token_path = str(tmp_path / "token.json")
+    tracing.enable_tracing(trace_path)
+    with tracing.span("pyoncatqt.login"):
+        widget.write_token({"access_token": "login"})
+    widget.write_token({"access_token": "refreshed"})
+    tracing.disable_tracing()
+
+    spans = [(span["name"], span["attributes"].get("refresh")) for span in read_spans(trace_path)]
+    assert spans == [("pyoncatqt.token.write", False), ("pyoncatqt.login", None), ("pyoncatqt.token.write", True)]
+
+
+def test_agent_request_span(trace_path: pytest.fixture) -> None:
+    with MockONCatServer() as server:
+        agent = tracing.TracedONCat(server.url, api_token="token")
+        # no span recorded while disabled
+        assert len(agent.Facility.list()) == 2
+        tracing.enable_tracing(trace_path)
+        assert len(agent.Facility.list()) == 2
+        tracing.disable_tracing()
+
+    (span,) = read_spans(trace_path)
+    assert span["name"] == "pyoncatqt.agent.request"
+    assert span["attributes"]["http.method"] == "GET"
+    assert span["attributes"]["endpoint"] == "api/facilities"
+    assert span["attributes"]["records"] == 2
+
+
+def test_traced_oncat_signature() -> None:
+    # TracedONCat overrides this private pyoncat method, it must keep its signature
+    parameters = inspect.signature(pyoncat.ONCat._call_method).parameters
+    assert list(parameters) == ["self", "method", "url", "data", "kwargs"]